@@ -0,0 +1,27 @@
+# export_excel.py
+# Merge the per-activity Parquet files written with --activity-format parquet
+# (out/activities/detail_<id>.parquet) into one xlsx. Run at the end of a scrape or on demand.
+import pandas as pd
+import os, glob, argparse
+
+from mustamir_cme_extractor import ACTIVITY_DIR, OUT_DIR, XLSX_ENGINE, log
+
+def export(src_dir: str, dest: str) -> int:
+    files = sorted(glob.glob(os.path.join(src_dir, "detail_*.parquet")))
+    if not files:
+        log(f"[warn] No detail_*.parquet files in {src_dir}")
+        return 0
+    df = pd.concat([pd.read_parquet(f) for f in files], ignore_index=True, sort=False)
+    if "Activity ID" in df.columns:
+        df = df.drop_duplicates(subset="Activity ID", keep="last")
+    df.to_excel(dest, index=False, engine=XLSX_ENGINE)
+    log(f"[ok] Wrote {len(df)} activities from {len(files)} files -> {dest}")
+    return len(df)
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Merge per-activity Parquet files into one xlsx.")
+    ap.add_argument("--src", type=str, default=ACTIVITY_DIR, help="Directory with detail_*.parquet files.")
+    ap.add_argument("--out", type=str, default=os.path.join(OUT_DIR, "activities_export.xlsx"),
+                    help="Destination xlsx.")
+    args = ap.parse_args()
+    export(args.src, args.out)
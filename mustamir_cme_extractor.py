@@ -1,546 +1,1312 @@
-# mustamir_cme_extractor.py
-# Adds optional S3 uploads and SHARDING (stride across pages).
-# NEW: --pages-file to process ONLY specific pages (e.g., missing pages list).
-# When --pages-file is provided, shards divide that list round-robin (no overlap).
-
-from playwright.sync_api import sync_playwright
-from urllib.parse import urlsplit
-import pandas as pd
-import os, re, time, argparse, sys
-from typing import Optional, List, Set
-
-# ---------- Optional S3 ----------
-_S3 = None
-def get_s3():
-    global _S3
-    if _S3 is None:
-        try:
-            import boto3
-            _S3 = boto3.client("s3")
-        except Exception as e:
-            raise RuntimeError(f"boto3 not available: {e}")
-    return _S3
-
-def s3_upload_file(local_path: str, bucket: str, key: str, retries: int = 5, backoff: float = 1.5):
-    s3 = get_s3()
-    last_err = None
-    for attempt in range(1, retries + 1):
-        try:
-            s3.upload_file(local_path, bucket, key)
-            return True
-        except Exception as e:
-            last_err = e
-            time.sleep(backoff ** attempt)
-    raise RuntimeError(f"S3 upload failed for s3://{bucket}/{key}: {last_err}")
-
-# ---------- Paths & constants ----------
-ROOT_URL = "https://mustamir.scfhs.org.sa/account/external-activities"
-OUT_DIR = "out"
-ACTIVITY_DIR = os.path.join(OUT_DIR, "activities")
-MASTER_XLSX = None  # set in main per shard
-
-# ---- Selectors ----
-LIST_COMPONENT = "app-list-external-activities"
-TBODY_SELECTOR = "div.primeng-datatable-container table tbody, div.p-datatable table tbody"
-ROW_SELECTOR = f"{TBODY_SELECTOR} tr"
-SPINNER_SELECTOR = "td.emptyTable .p-progress-spinner"
-
-PAGINATOR_ROOT = ".p-paginator"
-PAGINATOR_PAGES = ".p-paginator-pages"
-PAGINATOR_PAGE_BTN = f"{PAGINATOR_PAGES} .p-paginator-page.p-paginator-element.p-link"
-ACTIVE_PAGE_BTN = f"{PAGINATOR_PAGES} .p-paginator-page.p-highlight"
-NEXT_BTN = f"{PAGINATOR_ROOT} .p-paginator-next.p-paginator-element"
-
-ENGLISH_SWITCH = "a.p-2.text-white.hover1:has-text('English')"
-
-VIEW_CLICKS = [
-    "td:last-of-type .action.mx-2",
-    "td .action.mx-2",
-    'td:last-of-type svg[viewBox="0 0 511.626 511.626"]',
-    'svg[viewBox="0 0 511.626 511.626"]',
-]
-
-H4_ACTIVITY = "h4:has-text('Activity details'), h4:has-text('Activity Details')"
-DETAILS_BLOCK_UNDER_H4 = f"{H4_ACTIVITY} + div"
-FORM_GROUPS = f"{DETAILS_BLOCK_UNDER_H4} .form-group"
-LABEL_IN_GROUP = "label"
-P_IN_GROUP = "p"
-
-H5_SELECTOR = "h5"
-H5_NEXT_DIV_XPATH = "xpath=following-sibling::div[1]"
-SCIPRO_COMPONENT = "external-activity-agenda-list"
-
-ACCRED_LABEL = "label:has-text('Accredited CME Hours')"
-ACCRED_VALUE = f"{ACCRED_LABEL} + p"
-
-# ---------------- Utilities ----------------
-def log(msg): print(msg, flush=True)
-
-def ensure_out():
-    os.makedirs(ACTIVITY_DIR, exist_ok=True)
-
-def clean_spaces(s: str) -> str:
-    return re.sub(r"\s+", " ", s).strip()
-
-def text_or_empty(loc):
-    try:
-        if loc.count():
-            return loc.inner_text().strip()
-    except:
-        pass
-    return ""
-
-# --------------- List helpers ---------------
-def get_list_container(page, timeout_ms: int = 120000):
-    deadline = time.time() + (timeout_ms / 1000.0)
-    last_err = None
-    while time.time() < deadline:
-        try:
-            page.wait_for_selector(LIST_COMPONENT, state="visible", timeout=5000)
-            cont = page.locator(LIST_COMPONENT).first
-            if cont and cont.count() > 0 and cont.is_visible():
-                time.sleep(0.2)
-                if cont.locator(TBODY_SELECTOR).count() > 0 or cont.locator(SPINNER_SELECTOR).count() > 0:
-                    return cont
-        except Exception as e:
-            last_err = e
-        time.sleep(0.3)
-    raise RuntimeError(f"Could not find <app-list-external-activities> within {timeout_ms} ms"
-                       + (f" (last error: {last_err})" if last_err else ""))
-
-def tbody_html(container):
-    try: return container.locator(TBODY_SELECTOR).first.inner_html() or ""
-    except: return ""
-
-def wait_spinner_gone(container, timeout_s=30):
-    start = time.time()
-    while time.time() - start < timeout_s:
-        try:
-            sp = container.locator(SPINNER_SELECTOR)
-            if sp.count() == 0 or not sp.first.is_visible():
-                return
-        except: return
-        time.sleep(0.15)
-
-def wait_rows_ready(container):
-    wait_spinner_gone(container, timeout_s=30)
-    try: container.wait_for_selector(ROW_SELECTOR, timeout=5000)
-    except: pass
-
-def active_page_number(container) -> Optional[int]:
-    try:
-        btn = container.locator(ACTIVE_PAGE_BTN).first
-        if not btn.count(): return None
-        txt = btn.inner_text().strip()
-        return int(txt) if txt.isdigit() else None
-    except:
-        return None
-
-def wait_tbody_swap(container, prev_html, timeout_s=10):
-    start = time.time()
-    while time.time() - start < timeout_s:
-        cur = tbody_html(container)
-        if cur and cur != prev_html: return True
-        time.sleep(0.1)
-    return False
-
-def click_next(container, retries=3):
-    for _ in range(retries):
-        prev = tbody_html(container)
-        btn = container.locator(NEXT_BTN).first
-        if btn.count() and btn.is_enabled():
-            btn.click()
-            wait_rows_ready(container)
-            if wait_tbody_swap(container, prev, 10): return True
-        time.sleep(0.25)
-    return False
-
-def click_next_k(container, k: int) -> bool:
-    for _ in range(k):
-        if not click_next(container):
-            return False
-    return True
-
-def fast_forward_to_page(container, target_page, hard_cap_steps=4000):
-    cur = active_page_number(container)
-    if cur is None:
-        wait_rows_ready(container)
-        cur = active_page_number(container)
-    steps = 0
-    while cur and cur < target_page and steps < hard_cap_steps:
-        if not click_next(container): break
-        cur = active_page_number(container) or (cur + 1)
-        steps += 1
-    if cur != target_page:
-        log(f"[warn] Fast-forward ended on page {cur}, expected {target_page}")
-
-# ------------- Row helpers -------------
-def find_row_eye(row):
-    for sel in VIEW_CLICKS:
-        loc = row.locator(sel).first
-        try:
-            if loc.count() and loc.is_visible() and loc.is_enabled():
-                return loc
-        except: pass
-    return None
-
-def robust_switch_to_english(page):
-    attempts = 0
-    while True:
-        attempts += 1
-        try:
-            link = page.locator(ENGLISH_SWITCH).first
-            if link.count() and link.is_visible():
-                log(f"[info] Switching to English (attempt {attempts})…")
-                link.click()
-                page.wait_for_load_state("networkidle", timeout=60000)
-                page.wait_for_selector(LIST_COMPONENT, timeout=60000)
-                log("[info] English loaded.")
-                return
-            else:
-                if page.locator(LIST_COMPONENT).count():
-                    log("[info] English toggle not shown; assuming already English.")
-                    return
-        except Exception as e:
-            log(f"[warn] English switch attempt {attempts} failed: {e}")
-        time.sleep(min(2 * attempts, 10))
-
-# ---------- Detail page helpers ----------
-def wait_detail_ready(page):
-    deadline = time.time() + 30
-    while time.time() < deadline:
-        try:
-            if page.locator(".p-progress-spinner").count() == 0: break
-        except: break
-        time.sleep(0.15)
-    page.wait_for_selector(H4_ACTIVITY, timeout=30000)
-    try: page.wait_for_selector(H5_SELECTOR, timeout=30000)
-    except: pass
-
-def extract_activity_id_from_url(url: str) -> str:
-    path = urlsplit(url).path.strip("/")
-    last = path.split("/")[-1] if path else ""
-    m = re.search(r"(\d+)$", last)
-    return m.group(1) if m else last or ""
-
-def extract_detail(page) -> dict:
-    wait_detail_ready(page)
-    data = {}
-    url = page.url
-    data["URL"] = url
-    data["Activity ID"] = extract_activity_id_from_url(url)
-
-    groups = page.locator(FORM_GROUPS)
-    for i in range(groups.count()):
-        g = groups.nth(i)
-        label = clean_spaces(text_or_empty(g.locator(LABEL_IN_GROUP).first))
-        if not label: continue
-        vals = [clean_spaces(text_or_empty(p)) for p in g.locator(P_IN_GROUP).all()]
-        vals = [v for v in vals if v]
-        if vals: data[label] = " | ".join(vals)
-
-    h5s = page.locator(H5_SELECTOR)
-    for i in range(h5s.count()):
-        h5 = h5s.nth(i)
-        title = clean_spaces(text_or_empty(h5))
-        if not title: continue
-        if title.strip().lower() == "scientific program":
-            try:
-                next_div = h5.locator(H5_NEXT_DIV_XPATH).first
-                next_div.locator(SCIPRO_COMPONENT).wait_for(state="attached", timeout=20000)
-            except Exception: pass
-        next_div = h5.locator(H5_NEXT_DIV_XPATH).first
-        section_text = clean_spaces(text_or_empty(next_div))
-        if section_text: data[title] = section_text
-
-    accred = page.locator(ACCRED_VALUE).first
-    val = clean_spaces(text_or_empty(accred))
-    if val: data["Accredited CME Hours"] = val
-    return data
-
-def save_row_to_excels(row_dict: dict):
-    ensure_out()
-    act_id = row_dict.get("Activity ID", "unknown")
-    per_path = os.path.join(ACTIVITY_DIR, f"detail_{act_id}.xlsx")
-    pd.DataFrame([row_dict]).to_excel(per_path, index=False)
-
-    if os.path.exists(MASTER_XLSX):
-        master = pd.read_excel(MASTER_XLSX)
-        all_cols = list(dict.fromkeys(list(master.columns) + list(row_dict.keys())))
-        master = master.reindex(columns=all_cols)
-        new_row = pd.DataFrame([row_dict]).reindex(columns=all_cols)
-        master = pd.concat([master, new_row], ignore_index=True)
-    else:
-        master = pd.DataFrame([row_dict])
-    master.to_excel(MASTER_XLSX, index=False)
-    return per_path
-
-def recover_list(page, expected_page_no=None, list_timeout_ms: int = 120000):
-    try: page.wait_for_load_state("networkidle", timeout=list_timeout_ms)
-    except: pass
-    cont = get_list_container(page, timeout_ms=list_timeout_ms)
-    wait_rows_ready(cont)
-    if expected_page_no:
-        try:
-            cur = active_page_number(cont)
-            if cur != expected_page_no:
-                fast_forward_to_page(cont, expected_page_no)
-        except: pass
-    return cont, active_page_number(cont)
-
-# ---------- Pages file helpers ----------
-def parse_pages_file(path: str) -> List[int]:
-    if not path: return []
-    raw = open(path, "r", encoding="utf-8", errors="ignore").read()
-    # accept any separators (newline, comma, space)
-    tokens = re.findall(r"\d+", raw)
-    pages = sorted({int(t) for t in tokens if t.isdigit() and int(t) >= 1})
-    return pages
-
-def shard_pages(pages: List[int], shard_count: int, shard_index: int) -> List[int]:
-    """Round-robin split to avoid overlaps; stable order preserved."""
-    out = []
-    for i, p in enumerate(pages):
-        if i % shard_count == shard_index:
-            out.append(p)
-    return out
-
-# ------------- Main -------------
-def main(max_pages:int, headless:bool, start_page:int, list_timeout_ms:int,
-         s3_bucket: Optional[str], s3_prefix: str, s3_master_every: int,
-         shard_count:int, shard_index:int, pages_file: Optional[str]):
-
-    # ---- validate shards ----
-    if shard_count < 1:
-        raise ValueError("--shard-count must be >= 1")
-    if not (0 <= shard_index < shard_count):
-        raise ValueError("--shard-index must be in [0, shard-count-1]")
-
-    # shard-aware paths
-    global MASTER_XLSX
-    shard_suffix = "" if shard_count == 1 else f"_shard{shard_index+1}of{shard_count}"
-    MASTER_XLSX = os.path.join(OUT_DIR, f"external_activities_master{shard_suffix}.xlsx")
-    ensure_out()
-
-    if s3_bucket:
-        s3_prefix = f"{s3_prefix.rstrip('/')}/shard_{shard_index+1}of{shard_count}"
-
-    # If a pages-file was provided, load and split it per shard
-    target_pages: List[int] = []
-    if pages_file:
-        all_pages = parse_pages_file(pages_file)
-        target_pages = shard_pages(all_pages, shard_count, shard_index)
-        log(f"[info] Loaded {len(all_pages)} pages from {pages_file}; "
-            f"this shard will process {len(target_pages)} of them.")
-
-    uploaded_rows = 0
-    def maybe_upload_activity(filepath: str):
-        if not s3_bucket: return
-        rel = os.path.relpath(filepath, start=OUT_DIR).replace("\\", "/")
-        key = f"{s3_prefix.rstrip('/')}/{rel}"
-        log(f"[s3] upload {rel} -> s3://{s3_bucket}/{key}")
-        s3_upload_file(filepath, s3_bucket, key)
-
-    def maybe_upload_master(force=False):
-        nonlocal uploaded_rows
-        if not s3_bucket: return
-        if force or uploaded_rows >= s3_master_every:
-            uploaded_rows = 0
-            rel = os.path.relpath(MASTER_XLSX, start=OUT_DIR).replace("\\", "/")
-            key = f"{s3_prefix.rstrip('/')}/{rel}"
-            log(f"[s3] upload master -> s3://{s3_bucket}/{key}")
-            s3_upload_file(MASTER_XLSX, s3_bucket, key)
-
-    with sync_playwright() as p:
-        browser = p.chromium.launch(headless=headless)
-        ctx = browser.new_context()
-        page = ctx.new_page()
-        log(f"[step] Shard {shard_index+1}/{shard_count} starting. Go to root list")
-        # Robust navigation: keep trying until connected
-        while True:
-            try:
-                page.goto(ROOT_URL, wait_until="networkidle", timeout=90000)
-                break
-            except Exception as e:
-                log(f"[warn] Initial goto failed, retrying in 3s: {e}")
-                time.sleep(3)
-
-        robust_switch_to_english(page)
-
-        cont = get_list_container(page, timeout_ms=list_timeout_ms)
-        wait_rows_ready(cont)
-
-        # --- MODE A: process a specific set of pages (from --pages-file) ---
-        if target_pages:
-            # Ensure ascending unique pages
-            target_pages = sorted(set(target_pages))
-            for tp in target_pages:
-                try:
-                    cur = active_page_number(cont) or 1
-                    if cur != tp:
-                        log(f"[step] Jump to target page {tp} (current {cur}) …")
-                        fast_forward_to_page(cont, tp)
-                        cont, _ = recover_list(page, expected_page_no=tp, list_timeout_ms=list_timeout_ms)
-
-                    # process this page
-                    log(f"[page][shard {shard_index+1}/{shard_count}] Processing page {tp}")
-                    rows = cont.locator(ROW_SELECTOR)
-                    row_count = rows.count()
-                    log(f"[info] rows found: {row_count}")
-
-                    for r in range(row_count):
-                        try:
-                            rows = cont.locator(ROW_SELECTOR)
-                            row = rows.nth(r)
-                            eye = find_row_eye(row)
-                            if not eye:
-                                log(f"[skip] no 'view' action for row {r+1} on page {tp}")
-                                continue
-
-                            prev_html = tbody_html(cont)
-                            with page.expect_navigation():
-                                eye.click()
-                            try:
-                                record = extract_detail(page)
-                                log(f"[ok] extracted Activity ID={record.get('Activity ID', '?')}")
-                                per_file = save_row_to_excels(record)
-                                uploaded_rows += 1
-                                maybe_upload_activity(per_file)
-                                maybe_upload_master(force=False)
-                            except Exception as e:
-                                log(f"[warn] extraction failed on page {tp}, row {r+1}: {e}")
-
-                            try:
-                                page.get_by_role("button", name="Back", exact=True).click()
-                            except:
-                                page.go_back(wait_until="networkidle", timeout=60000)
-                            cont, _ = recover_list(page, expected_page_no=tp, list_timeout_ms=list_timeout_ms)
-                        except Exception as e:
-                            log(f"[warn] Row {r+1} failure on page {tp}: {e}")
-                            try:
-                                cont, _ = recover_list(page, expected_page_no=tp, list_timeout_ms=list_timeout_ms)
-                            except:
-                                continue
-
-                    maybe_upload_master(force=True)
-
-                    # honor --max-pages for this mode too (pages count per shard)
-                    if max_pages:
-                        processed_so_far = target_pages.index(tp) + 1
-                        if processed_so_far >= max_pages:
-                            log("[done] Reached --max-pages cap for this shard (pages-file mode).")
-                            break
-
-                except Exception as e:
-                    log(f"[warn] Could not complete target page {tp}: {e}")
-                    # try to recover to list (page number may be unknown now)
-                    try:
-                        cont, _ = recover_list(page, list_timeout_ms=list_timeout_ms)
-                    except:
-                        pass
-
-            maybe_upload_master(force=True)
-            browser.close()
-            return
-
-        # --- MODE B: legacy stride mode (no pages-file) ---
-        eff_start = max(1, start_page) + (shard_index if shard_count > 1 else 0)
-        if eff_start > 1:
-            log(f"[step] Fast-forwarding to shard start page {eff_start} …")
-            try: fast_forward_to_page(cont, eff_start)
-            except Exception as e: log(f"[warn] Could not fast-forward neatly: {e}")
-
-        processed_pages = 0
-        current_page = active_page_number(cont) or eff_start
-
-        while True:
-            n = current_page
-            log(f"[page][shard {shard_index+1}/{shard_count}] Processing page {n}")
-            rows = cont.locator(ROW_SELECTOR)
-            row_count = rows.count()
-            log(f"[info] rows found: {row_count}")
-
-            for r in range(row_count):
-                try:
-                    rows = cont.locator(ROW_SELECTOR)
-                    row = rows.nth(r)
-                    eye = find_row_eye(row)
-                    if not eye:
-                        log(f"[skip] no 'view' action for row {r+1} on page {n}")
-                        continue
-
-                    prev_html = tbody_html(cont)
-                    with page.expect_navigation():
-                        eye.click()
-                    try:
-                        record = extract_detail(page)
-                        log(f"[ok] extracted Activity ID={record.get('Activity ID', '?')}")
-                        per_file = save_row_to_excels(record)
-                        uploaded_rows += 1
-                        maybe_upload_activity(per_file)
-                        maybe_upload_master(force=False)
-                    except Exception as e:
-                        log(f"[warn] extraction failed on page {n}, row {r+1}: {e}")
-
-                    try: page.get_by_role("button", name="Back", exact=True).click()
-                    except: page.go_back(wait_until="networkidle", timeout=60000)
-                    cont, _ = recover_list(page, expected_page_no=n, list_timeout_ms=list_timeout_ms)
-                except Exception as e:
-                    log(f"[warn] Row {r+1} failure: {e}")
-                    try: cont, _ = recover_list(page, expected_page_no=n, list_timeout_ms=list_timeout_ms)
-                    except: continue
-
-            processed_pages += 1
-            maybe_upload_master(force=True)
-
-            if max_pages and processed_pages >= max_pages:
-                log("[done] Reached --max-pages cap for this shard.")
-                break
-
-            stride = shard_count if shard_count > 1 else 1
-            if not click_next_k(cont, stride):
-                log("[done] Reached last page (or next disabled) for this shard.")
-                break
-            current_page = (active_page_number(cont) or (current_page + stride))
-
-        maybe_upload_master(force=True)
-        browser.close()
-
-if __name__ == "__main__":
-    ap = argparse.ArgumentParser()
-    ap.add_argument("--max-pages", type=int, default=0,
-                    help="How many pages THIS SHARD will process (0 = until end; applies to pages-file mode too).")
-    ap.add_argument("--start-page", type=int, default=1,
-                    help="Global 1-based start page. With sharding, effective start = start-page + shard-index.")
-    ap.add_argument("--headless", action="store_true", help="Run headless.")
-    ap.add_argument("--list-timeout-ms", type=int, default=120000,
-                    help="Timeout in ms to wait for <app-list-external-activities> to appear/settle.")
-
-    # Optional S3
-    ap.add_argument("--s3-bucket", type=str, default="", help="If set, upload outputs to this S3 bucket.")
-    ap.add_argument("--s3-prefix", type=str, default="runs/current",
-                    help="Key prefix (e.g., runs/2025-11-05).")
-    ap.add_argument("--s3-master-upload-every", type=int, default=25,
-                    help="Upload master every N rows (plus end-of-page/end-of-run).")
-
-    # Sharding
-    ap.add_argument("--shard-count", type=int, default=1, help="Total parallel shards.")
-    ap.add_argument("--shard-index", type=int, default=0, help="Zero-based shard index (0..count-1).")
-
-    # NEW: pages file
-    ap.add_argument("--pages-file", type=str, default="",
-                    help="Path to a text file listing EXACT pages to process (one per line, commas/spaces OK).")
-
-    args = ap.parse_args()
-    main(
-        max_pages=args.max_pages,
-        headless=args.headless,
-        start_page=args.start_page,
-        list_timeout_ms=args.list_timeout_ms,
-        s3_bucket=(args.s3_bucket or None),
-        s3_prefix=args.s3_prefix,
-        s3_master_every=max(1, args.s3_master_upload_every),
-        shard_count=args.shard_count,
-        shard_index=args.shard_index,
-        pages_file=(args.pages_file or None),
-    )
\ No newline at end of file
+# mustamir_cme_extractor.py
+# Adds optional S3 uploads and SHARDING (stride across pages).
+# NEW: --pages-file to process ONLY specific pages (e.g., missing pages list).
+# When --pages-file is provided, shards divide that list round-robin (no overlap).
+# NEW: async Playwright. One browser per run; the list page keeps its own context and
+# detail pages are opened by URL in parallel across --workers worker contexts.
+# --in-process-shards K runs a K-way split as async tasks on that one browser.
+
+from playwright.async_api import async_playwright, TimeoutError as PWTimeoutError
+from urllib.parse import urlsplit, urlencode, parse_qsl
+from openpyxl import Workbook
+import pandas as pd
+import os, re, csv, json, glob, time, random, shutil, argparse, sys, asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Optional, List, Set
+
+# ---------- Optional S3 ----------
+# Retries live in botocore: adaptive mode adds client-side rate limiting on SlowDown/503
+# on top of jittered exponential backoff, shared by every upload through this client.
+S3_MAX_ATTEMPTS = 10
+S3_MAX_POOL_CONNECTIONS = 50
+# A few outer attempts only for transfers that outlive botocore's retries. Full jitter,
+# capped, so shards that failed together do not retry together.
+S3_UPLOAD_RETRIES = 3
+S3_BACKOFF_BASE_S = 0.5
+S3_BACKOFF_CAP_S = 30
+S3_FATAL_CODES = {"AccessDenied", "AllAccessDisabled", "NoSuchBucket",
+                  "InvalidAccessKeyId", "SignatureDoesNotMatch"}
+UPLOAD_WORKERS = 8  # background upload threads; scraping never waits on a PUT
+# Big files (the master xlsx late in a run) go up as parallel multipart parts.
+S3_MULTIPART_THRESHOLD = 8 * 1024 * 1024
+S3_TRANSFER_CONCURRENCY = 8
+
+_S3 = None
+_S3_TRANSFER = None
+def get_s3():
+    global _S3, _S3_TRANSFER
+    if _S3 is None:
+        try:
+            import boto3
+            from boto3.s3.transfer import TransferConfig
+            from botocore.config import Config
+            _S3_TRANSFER = TransferConfig(multipart_threshold=S3_MULTIPART_THRESHOLD,
+                                          max_concurrency=S3_TRANSFER_CONCURRENCY, use_threads=True)
+            _S3 = boto3.client("s3", config=Config(
+                retries={"mode": "adaptive", "max_attempts": S3_MAX_ATTEMPTS},
+                max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+                tcp_keepalive=True,
+                connect_timeout=5,
+                read_timeout=60,
+            ))
+        except Exception as e:
+            raise RuntimeError(f"boto3 not available: {e}")
+    return _S3
+
+def _s3_error_code(e) -> str:
+    # upload_file wraps the botocore ClientError in S3UploadFailedError; walk the chain
+    while e is not None:
+        resp = getattr(e, "response", None)
+        if isinstance(resp, dict):
+            return resp.get("Error", {}).get("Code", "")
+        e = e.__cause__ or e.__context__
+    return ""
+
+def s3_upload_file(local_path: str, bucket: str, key: str, retries: int = S3_UPLOAD_RETRIES):
+    s3 = get_s3()
+    last_err = None
+    for attempt in range(retries):
+        try:
+            s3.upload_file(local_path, bucket, key, Config=_S3_TRANSFER)
+            return True
+        except Exception as e:
+            last_err = e
+            if _s3_error_code(e) in S3_FATAL_CODES:
+                break  # retrying cannot fix permissions or a missing bucket
+            if attempt + 1 < retries:
+                time.sleep(random.uniform(0, min(S3_BACKOFF_CAP_S, S3_BACKOFF_BASE_S * 2 ** attempt)))
+    raise RuntimeError(f"S3 upload failed for s3://{bucket}/{key}: {last_err}")
+
+# ---------- Paths & constants ----------
+ROOT_URL = "https://mustamir.scfhs.org.sa/account/external-activities"
+OUT_DIR = "out"
+ACTIVITY_DIR = os.path.join(OUT_DIR, "activities")
+STATE_PATH = os.path.join(OUT_DIR, ".playwright_state.json")  # cookies/localStorage incl. language
+DETAIL_URL_PATH = os.path.join(OUT_DIR, ".detail_url.json")    # learned detail URL pattern
+XHR_DIR = os.path.join(OUT_DIR, "xhr")                          # --log-xhr samples
+SENSITIVE_HEADERS = {"cookie", "authorization", "proxy-authorization", "x-xsrf-token", "x-csrf-token"}
+
+# ---- Selectors ----
+LIST_COMPONENT = "app-list-external-activities"
+TBODY_SELECTOR = "div.primeng-datatable-container table tbody, div.p-datatable table tbody"
+ROW_SELECTOR = f":is({TBODY_SELECTOR}) tr"
+SPINNER_SELECTOR = "td.emptyTable .p-progress-spinner"
+LIST_READY = f"{LIST_COMPONENT} :is({TBODY_SELECTOR}, {SPINNER_SELECTOR})"
+DETAIL_SPINNER = ".p-progress-spinner"
+
+PAGINATOR_ROOT = ".p-paginator"
+PAGINATOR_PAGES = ".p-paginator-pages"
+PAGINATOR_PAGE_BTN = f"{PAGINATOR_PAGES} .p-paginator-page.p-paginator-element.p-link"
+ACTIVE_PAGE_BTN = f"{PAGINATOR_PAGES} .p-paginator-page.p-highlight"
+NEXT_BTN = f"{PAGINATOR_ROOT} .p-paginator-next.p-paginator-element"
+PREV_BTN = f"{PAGINATOR_ROOT} .p-paginator-prev.p-paginator-element"
+FIRST_BTN = f"{PAGINATOR_ROOT} .p-paginator-first.p-paginator-element"
+LAST_BTN = f"{PAGINATOR_ROOT} .p-paginator-last.p-paginator-element"
+FAR_JUMP_PAGES = 50  # beyond this, probe the last page before walking
+PAGINATOR_JUMP_INPUT = (f"{PAGINATOR_ROOT} .p-paginator-page-input input, "
+                        f"{PAGINATOR_ROOT} input.p-paginator-jump-to-page-input")
+
+ENGLISH_SWITCH = "a.p-2.text-white.hover1:has-text('English')"
+
+VIEW_CLICKS = [
+    "td:last-of-type .action.mx-2",
+    "td .action.mx-2",
+    'td:last-of-type svg[viewBox="0 0 511.626 511.626"]',
+    'svg[viewBox="0 0 511.626 511.626"]',
+]
+_EYE_SEL: Optional[str] = None  # first VIEW_CLICKS entry that worked this run
+
+# One pass over the tbody: per row, the detail URL behind the eye action (null if the
+# action is a router click handler rather than a link) plus the cell texts.
+ROWS_JS = """(tbody) => Array.from(tbody.querySelectorAll('tr')).map(tr => {
+  const eye = tr.querySelector('td:last-of-type .action.mx-2, td .action.mx-2');
+  const a = eye ? (eye.closest('a[href]') || eye.querySelector('a[href]'))
+                : tr.querySelector('td:last-of-type a[href]');
+  return {href: a ? a.href : null, cells: Array.from(tr.cells).map(td => (td.innerText || '').trim())};
+})"""
+
+# Change-detection token for the list tbody: row count + first/last row text (a few bytes
+# instead of serialising the whole tbody on every check).
+_TBODY_SIG_EXPR = "t.rows.length + '|' + (t.rows[0]?.innerText || '') + '|' + (t.rows[t.rows.length - 1]?.innerText || '')"
+TBODY_SIG_JS = f"(t) => {_TBODY_SIG_EXPR}"
+TBODY_CHANGED_JS = f"""([root, tbody, prev]) => {{
+  const t = document.querySelector(root)?.querySelector(tbody);
+  return !!t && t.rows.length > 0 && !t.querySelector('td.emptyTable') && ({_TBODY_SIG_EXPR}) !== prev;
+}}"""
+
+# Learned from the first click-through: detail URL = DETAIL_URL_BASE + text of cell DETAIL_ID_COL
+DETAIL_URL_BASE: Optional[str] = None
+DETAIL_ID_COL: Optional[int] = None
+
+H4_ACTIVITY = "h4:has-text('Activity details'), h4:has-text('Activity Details')"
+DETAIL_OR_SWITCH = f"{H4_ACTIVITY}, {ENGLISH_SWITCH}"
+DETAIL_SETTLED_JS = "([spin, h5]) => !document.querySelector(spin) && !!document.querySelector(h5)"
+H5_SELECTOR = "h5"
+H5_NEXT_DIV_XPATH = "xpath=following-sibling::div[1]"
+SCIPRO_COMPONENT = "external-activity-agenda-list"
+SCIPRO_TITLE_RE = re.compile(r"^\s*scientific program\s*$", re.I)
+
+# Whole detail page in one evaluate, as ordered [key, value] pairs. Plain-DOM versions of:
+#   "h4:has-text('Activity details') + div .form-group"  -> label: p | p | ...
+#   "h5" + "following-sibling::div[1]"                   -> section title: text
+#   "label:has-text('Accredited CME Hours') + p"
+DETAIL_JS = """() => {
+  const clean = s => (s || '').replace(/\\s+/g, ' ').trim();
+  const out = [];
+  for (const h4 of document.querySelectorAll('h4')) {
+    if (!/activity details/i.test(h4.innerText)) continue;
+    const block = h4.nextElementSibling;
+    if (!block || block.tagName !== 'DIV') continue;
+    for (const g of block.querySelectorAll('.form-group')) {
+      const label = clean(g.querySelector('label')?.innerText);
+      if (!label) continue;
+      const vals = Array.from(g.querySelectorAll('p'), p => clean(p.innerText)).filter(Boolean);
+      if (vals.length) out.push([label, vals.join(' | ')]);
+    }
+  }
+  for (const h5 of document.querySelectorAll('h5')) {
+    const title = clean(h5.innerText);
+    if (!title) continue;
+    let nd = h5.nextElementSibling;
+    while (nd && nd.tagName !== 'DIV') nd = nd.nextElementSibling;
+    const text = clean(nd?.innerText);
+    if (text) out.push([title, text]);
+  }
+  for (const l of document.querySelectorAll('label')) {
+    if (!/accredited cme hours/i.test(l.innerText)) continue;
+    const p = l.nextElementSibling;
+    if (!p || p.tagName !== 'P') continue;
+    const v = clean(p.innerText);
+    if (v) out.push(['Accredited CME Hours', v]);
+    break;
+  }
+  return out;
+}"""
+
+DEFAULT_WORKERS = 4
+DEFAULT_RECYCLE_EVERY = 200  # detail navigations per worker context before it is replaced
+
+# Browser-side retries (initial list load, English switch): full jitter, capped.
+NAV_RETRY_BASE_S = 1.0       # timeouts / not-yet-rendered
+NAV_RETRY_BASE_NET_S = 0.25  # net::ERR_* (dropped connection, DNS blip)
+NAV_RETRY_CAP_S = 60
+
+# ---- Browser/context options: nothing the text extraction needs is turned off ----
+# Default viewport on purpose: a narrow one could switch the table to its mobile layout.
+CONTEXT_OPTS = dict(service_workers="block",  # SW fetches would bypass the route filter
+                    reduced_motion="reduce")
+LAUNCH_ARGS = ["--disable-dev-shm-usage", "--disable-gpu", "--disable-background-networking",
+               "--disable-features=Translate,BackForwardCache,MediaRouter,OptimizationHints"]
+LAUNCH_ARGS_NO_ASSETS = ["--blink-settings=imagesEnabled=false"]  # unless --no-block-assets
+
+# ---- Network filtering: only HTML/JS/XHR are needed to read text nodes ----
+BLOCKED_RESOURCE_TYPES = {"image", "media", "font", "stylesheet"}
+BLOCKED_HOSTS = ("google-analytics", "googletagmanager", "doubleclick", "hotjar",
+                 "clarity.ms", "facebook.net")
+
+# ---- Regexes (compiled once) ----
+_ID_RE = re.compile(r"(\d+)$")
+_DIGITS_RE = re.compile(r"\d+")
+_UNSAFE_NAME_RE = re.compile(r"[^\w.-]+")
+_PATH_ID_RE = re.compile(r"/(?:\d+|[0-9a-fA-F-]{16,})(?=/|$)")  # numeric / uuid-ish path segments
+_ACTIVITY_FILE_RE = re.compile(r"detail_(\d+)\.(?:xlsx|parquet)$")
+_SENSITIVE_KEY_RE = re.compile(r"token|passw|secret|session|csrf|xsrf|auth(?!ors?$)|api_?key|^(?:key|otp|sig|signature)$", re.I)  # query/body field names
+
+# ---------------- Utilities ----------------
+def log(msg): print(msg, flush=True)
+
+# ---- Timing spans (--trace-spans): one JSON line per span, totals at the end ----
+TRACE_SPANS = False
+_SPAN_TOTALS: dict = {}  # name -> [count, total_ms]
+_SPAN_LOCK = threading.Lock()  # spans also close on the writer thread
+
+@contextmanager
+def span(name: str, **fields):
+    if not TRACE_SPANS:
+        yield
+        return
+    t0 = time.perf_counter_ns()
+    try:
+        yield
+    finally:
+        ms = (time.perf_counter_ns() - t0) / 1e6
+        with _SPAN_LOCK:
+            tot = _SPAN_TOTALS.setdefault(name, [0, 0.0])
+            tot[0] += 1
+            tot[1] += ms
+        log(json.dumps({"span": name, "ms": round(ms, 2), **fields}))
+
+def log_span_totals():
+    for name, (n, ms) in sorted(_SPAN_TOTALS.items(), key=lambda kv: -kv[1][1]):
+        log(f"[span] {name}: {n}x, total {ms/1000:.1f}s, mean {ms/n:.1f}ms")
+
+def ensure_out():
+    os.makedirs(ACTIVITY_DIR, exist_ok=True)
+
+def clean_spaces(s: str) -> str:
+    # split/join beats a regex for plain whitespace runs; runs on list-row cells while matching IDs
+    return " ".join(s.split())
+
+def retry_delay(attempt: int, err=None) -> float:
+    """Full-jitter exponential backoff for browser retries. Connection-level failures
+    (net::ERR_*) retry fast; timeouts mean the site is slow, so they ramp from a higher base."""
+    base = NAV_RETRY_BASE_NET_S if "net::ERR" in str(err) else NAV_RETRY_BASE_S
+    return random.uniform(0, min(NAV_RETRY_CAP_S, base * 2 ** attempt))
+
+async def _route_filter(route):
+    req = route.request
+    if req.resource_type in BLOCKED_RESOURCE_TYPES or any(h in req.url for h in BLOCKED_HOSTS):
+        await route.abort()
+    else:
+        await route.continue_()
+
+async def install_asset_blocking(ctx):
+    await ctx.route("**/*", _route_filter)
+
+async def new_list_context(browser):
+    """Start from the saved storage state when one exists so the app boots in English."""
+    if os.path.exists(STATE_PATH):
+        try:
+            ctx = await browser.new_context(storage_state=STATE_PATH, **CONTEXT_OPTS)
+            log(f"[info] Restored browser state from {STATE_PATH}")
+            return ctx
+        except Exception as e:
+            log(f"[warn] Ignoring unreadable {STATE_PATH}: {e}")
+    return await browser.new_context(**CONTEXT_OPTS)
+
+def _redact(obj):
+    """Copy of a JSON value with credential-like fields (by key name) redacted."""
+    if isinstance(obj, dict):
+        return {k: ("<redacted>" if _SENSITIVE_KEY_RE.search(str(k)) else _redact(v)) for k, v in obj.items()}
+    if isinstance(obj, list): return [_redact(v) for v in obj]
+    return obj
+
+def _redact_query(qs: str) -> str:
+    pairs = parse_qsl(qs, keep_blank_values=True)
+    return urlencode([(k, "<redacted>" if _SENSITIVE_KEY_RE.search(k) else v) for k, v in pairs], safe="<>{}")
+
+def redact_url(url: str) -> str:
+    parts = urlsplit(url)
+    return parts._replace(query=_redact_query(parts.query)).geturl() if parts.query else url
+
+def redact_body(body: str) -> str:
+    """Request body with credential-like fields redacted (JSON or form-encoded); other bodies as is."""
+    if not body: return body
+    try: return json.dumps(_redact(json.loads(body)), ensure_ascii=False)
+    except ValueError: pass
+    return _redact_query(body) if "=" in body and " " not in body else body
+
+def watch_xhr(page, seen: Optional[set] = None):
+    """Log each distinct XHR/fetch call the page makes (once per method + path, with ID
+    segments folded to {id}), with its request body, and keep one sample of each JSON
+    exchange (request URL, headers, body and the response payload) under out/xhr/, so the
+    list and detail endpoints and their paging params can be identified offline.
+    Credential headers, and query params / JSON or form fields whose name looks like a
+    token, key or password, are redacted; everything else is kept as the site sent it."""
+    seen = set() if seen is None else seen
+    async def on_response(resp):
+        req = resp.request
+        if req.resource_type not in ("xhr", "fetch"): return
+        path = _PATH_ID_RE.sub("/{id}", urlsplit(resp.url).path)
+        if (req.method, path) in seen: return
+        seen.add((req.method, path))
+        ctype = resp.headers.get("content-type", "")
+        body = redact_body(req.post_data or "")
+        url = redact_url(resp.url)
+        log(f"[xhr] {req.method} {resp.status} {url} [{ctype}]"
+            + (f" body={body[:300]}" if body else ""))
+        if "json" not in ctype: return
+        try:
+            sample = {"method": req.method, "url": url, "status": resp.status,
+                      "request_headers": {k: ("<redacted>" if k.lower() in SENSITIVE_HEADERS else v)
+                                          for k, v in (await req.all_headers()).items()},
+                      "request_body": body,
+                      "response": _redact(json.loads(await resp.body()))}
+            name = _UNSAFE_NAME_RE.sub("_", f"{req.method}_{path}").strip("_")[:120]
+            os.makedirs(XHR_DIR, exist_ok=True)
+            with open(os.path.join(XHR_DIR, f"{name}.json"), "w", encoding="utf-8") as fh:
+                json.dump(sample, fh, ensure_ascii=False, indent=1)
+        except Exception as e:
+            log(f"[warn] could not save xhr sample for {path}: {e}")
+    page.on("response", on_response)
+    return seen
+
+# --------------- List helpers ---------------
+async def get_list_container(page, timeout_ms: int = 120000):
+    # one Playwright-side wait instead of a Python polling loop
+    try:
+        await page.wait_for_selector(LIST_READY, state="attached", timeout=timeout_ms)
+    except Exception as e:
+        raise RuntimeError(f"Could not find <app-list-external-activities> within {timeout_ms} ms "
+                           f"(last error: {e})")
+    return page.locator(LIST_COMPONENT).first
+
+async def tbody_signature(container):
+    try: return await container.locator(TBODY_SELECTOR).first.evaluate(TBODY_SIG_JS)
+    except: return ""
+
+async def harvest_rows(container) -> List[dict]:
+    """Snapshot of the visible rows as {href, cells} in a single round-trip."""
+    try: return await container.locator(TBODY_SELECTOR).first.evaluate(ROWS_JS)
+    except: return []
+
+def learn_detail_url(record: dict, cells: List[str]):
+    """After a click-through, find which row cell holds the activity ID so later
+    href-less rows can be opened directly by URL."""
+    global DETAIL_URL_BASE, DETAIL_ID_COL
+    if DETAIL_URL_BASE is not None: return
+    url = record.get("URL", "").split("?")[0].rstrip("/")
+    aid = record.get("Activity ID", "")
+    if not aid or not url.endswith(aid): return
+    for i, c in enumerate(cells):
+        if clean_spaces(c) == aid:
+            DETAIL_URL_BASE, DETAIL_ID_COL = url[:-len(aid)], i
+            log(f"[info] Detail URL pattern learned: {DETAIL_URL_BASE}<id> (row column {i+1})")
+            try:
+                with open(DETAIL_URL_PATH, "w", encoding="utf-8") as fh:
+                    json.dump({"base": DETAIL_URL_BASE, "id_col": DETAIL_ID_COL}, fh)
+            except Exception as e:
+                log(f"[warn] Could not save detail URL pattern: {e}")
+            return
+
+def load_detail_url():
+    """Reuse a pattern learned by an earlier run, so a resumed run can skip seen rows
+    (and open the rest by URL) without clicking through first."""
+    global DETAIL_URL_BASE, DETAIL_ID_COL
+    if DETAIL_URL_BASE is not None or not os.path.exists(DETAIL_URL_PATH): return
+    try:
+        with open(DETAIL_URL_PATH, encoding="utf-8") as fh:
+            d = json.load(fh)
+        DETAIL_URL_BASE, DETAIL_ID_COL = d["base"], int(d["id_col"])
+        log(f"[info] Detail URL pattern loaded: {DETAIL_URL_BASE}<id> (row column {DETAIL_ID_COL+1})")
+    except Exception as e:
+        log(f"[warn] Ignoring unreadable {DETAIL_URL_PATH}: {e}")
+
+def row_detail_url(row: dict) -> Optional[str]:
+    if row.get("href"): return row["href"]
+    if DETAIL_URL_BASE is None: return None
+    cells = row.get("cells") or []
+    if DETAIL_ID_COL < len(cells):
+        aid = clean_spaces(cells[DETAIL_ID_COL])
+        if aid.isdigit(): return DETAIL_URL_BASE + aid
+    return None
+
+async def wait_spinner_gone(container, timeout_s=30):
+    try: await container.locator(SPINNER_SELECTOR).first.wait_for(state="hidden", timeout=timeout_s * 1000)
+    except: pass
+
+async def wait_rows_ready(container):
+    await wait_spinner_gone(container, timeout_s=30)
+    try: await container.locator(ROW_SELECTOR).first.wait_for(timeout=5000)
+    except: pass
+
+async def active_page_number(container) -> Optional[int]:
+    try:
+        btn = container.locator(ACTIVE_PAGE_BTN).first
+        if not await btn.count(): return None
+        txt = (await btn.inner_text()).strip()
+        return int(txt) if txt.isdigit() else None
+    except:
+        return None
+
+async def wait_tbody_swap(container, prev_sig, timeout_s=10):
+    try:
+        await container.page.wait_for_function(TBODY_CHANGED_JS, arg=[LIST_COMPONENT, TBODY_SELECTOR, prev_sig],
+                                               timeout=timeout_s * 1000)
+        return True
+    except:
+        return False
+
+async def click_pager_btn(container, selector, retries=4):
+    """Click a paginator control (Next/Prev/First/Last) and wait for the rows to swap."""
+    for attempt in range(retries):
+        prev = await tbody_signature(container)
+        btn = container.locator(selector).first
+        if await btn.count() and await btn.is_enabled():
+            await btn.click()
+            await wait_rows_ready(container)
+            if await wait_tbody_swap(container, prev, 10): return True
+        # a briefly disabled button is usually back within tens of ms; back off from there
+        await asyncio.sleep(min(0.5, 0.05 * 2 ** attempt))
+    return False
+
+async def click_next(container, retries=4):
+    with span("click_next"):
+        return await click_pager_btn(container, NEXT_BTN, retries)
+
+async def click_next_k(container, k: int) -> bool:
+    for _ in range(k):
+        if not await click_next(container):
+            return False
+    return True
+
+async def jump_to_page(container, target_page) -> bool:
+    """Use the paginator's jump-to-page input if the table renders one (one round-trip)."""
+    inp = container.locator(PAGINATOR_JUMP_INPUT).first
+    try:
+        if not await inp.count() or not await inp.is_visible(): return False
+        prev = await tbody_signature(container)
+        await inp.fill(str(target_page))
+        await inp.press("Enter")
+        await wait_rows_ready(container)
+        await wait_tbody_swap(container, prev, 10)
+        return await active_page_number(container) == target_page
+    except:
+        return False
+
+async def click_furthest_page(container, cur, target_page) -> Optional[int]:
+    """Click the visible page link closest to target_page without passing it
+    (in either direction)."""
+    lo, hi = min(cur, target_page), max(cur, target_page)
+    try:
+        btns = container.locator(PAGINATOR_PAGE_BTN)
+        nums = [int(t) if t.strip().isdigit() else 0 for t in await btns.all_inner_texts()]
+        best = min((n for n in nums if lo <= n <= hi and n != cur),
+                   key=lambda n: abs(target_page - n), default=None)
+        if best is None: return None
+        prev = await tbody_signature(container)
+        await btns.nth(nums.index(best)).click()
+        await wait_rows_ready(container)
+        if not await wait_tbody_swap(container, prev, 10): return None
+        return await active_page_number(container) or best
+    except:
+        return None
+
+async def fast_forward_to_page(container, target_page, hard_cap_steps=4000):
+    cur = await active_page_number(container)
+    if cur is None:
+        await wait_rows_ready(container)
+        cur = await active_page_number(container)
+    if cur and cur != target_page and await jump_to_page(container, target_page):
+        cur = target_page
+    # far from the first page: one click on Last reveals the page count; if the target
+    # is nearer the end, walk back from there, otherwise return to page 1. Only from
+    # page 1 -- from anywhere else the current position is already the best start.
+    if cur == 1 and target_page - cur > FAR_JUMP_PAGES and await click_pager_btn(container, LAST_BTN):
+        last = await active_page_number(container)
+        if last and last - target_page < target_page - cur:
+            log(f"[info] Target page {target_page} is nearer the end ({last}); rewinding from there.")
+            cur = last
+        elif await click_pager_btn(container, FIRST_BTN):
+            cur = await active_page_number(container) or 1
+        else:
+            cur = last
+    steps = 0
+    while cur and cur != target_page and steps < hard_cap_steps:
+        # leapfrog over the visible page links; Next/Prev only when none is closer
+        nxt = await click_furthest_page(container, cur, target_page)
+        if nxt is None:
+            forward = cur < target_page
+            if not await click_pager_btn(container, NEXT_BTN if forward else PREV_BTN): break
+            nxt = await active_page_number(container) or (cur + 1 if forward else cur - 1)
+        cur = nxt
+        steps += 1
+    if cur != target_page:
+        log(f"[warn] Fast-forward ended on page {cur}, expected {target_page}")
+
+# ------------- Row helpers -------------
+async def _usable(loc) -> bool:
+    try: return bool(await loc.count() and await loc.is_visible() and await loc.is_enabled())
+    except: return False
+
+async def find_row_eye(row):
+    # the selector that matched last time is tried first; the rest are only fallbacks
+    global _EYE_SEL
+    if _EYE_SEL is not None:
+        loc = row.locator(_EYE_SEL).first
+        if await _usable(loc): return loc
+    for sel in VIEW_CLICKS:
+        if sel == _EYE_SEL: continue
+        loc = row.locator(sel).first
+        if await _usable(loc):
+            _EYE_SEL = sel
+            return loc
+    return None
+
+async def robust_switch_to_english(page) -> bool:
+    """True if the toggle had to be clicked, False if the page was already in English."""
+    attempts = 0
+    while True:
+        attempts += 1
+        try:
+            link = page.locator(ENGLISH_SWITCH).first
+            if await link.count() and await link.is_visible():
+                log(f"[info] Switching to English (attempt {attempts})…")
+                await link.click()
+                # the toggle disappearing is the signal the language actually flipped
+                await page.locator(ENGLISH_SWITCH).first.wait_for(state="hidden", timeout=60000)
+                await page.wait_for_selector(LIST_COMPONENT, state="visible", timeout=60000)
+                log("[info] English loaded.")
+                return True
+            else:
+                if await page.locator(LIST_COMPONENT).count():
+                    log("[info] English toggle not shown; assuming already English.")
+                    return False
+        except Exception as e:
+            log(f"[warn] English switch attempt {attempts} failed: {e}")
+            await asyncio.sleep(retry_delay(attempts - 1, e))
+            continue
+        await asyncio.sleep(retry_delay(attempts - 1))
+
+async def ensure_english_detail(page, timeout_ms: int = 30000):
+    """Worker contexts start from the list context's storage state; if the language
+    choice did not carry over, flip this context to English once."""
+    await page.wait_for_selector(DETAIL_OR_SWITCH, timeout=timeout_ms)
+    link = page.locator(ENGLISH_SWITCH).first
+    if await link.count() and await link.is_visible():
+        log("[info] Worker context not in English; switching.")
+        await link.click()
+        await page.wait_for_selector(H4_ACTIVITY, timeout=timeout_ms)
+
+# ---------- Detail page helpers ----------
+async def wait_detail_ready(page):
+    await page.wait_for_selector(H4_ACTIVITY, timeout=30000)
+    # spinner gone and sections rendered, checked together in one in-page wait
+    try: await page.wait_for_function(DETAIL_SETTLED_JS, arg=[DETAIL_SPINNER, H5_SELECTOR], timeout=30000)
+    except PWTimeoutError: pass
+
+def extract_activity_id_from_url(url: str) -> str:
+    last = urlsplit(url).path.rstrip("/").rsplit("/", 1)[-1]
+    m = _ID_RE.search(last)
+    return m.group(1) if m else last
+
+async def wait_scientific_program(page):
+    """The agenda component renders after the rest of the page; wait for it if the section exists."""
+    try:
+        h5 = page.locator(H5_SELECTOR).filter(has_text=SCIPRO_TITLE_RE).first
+        if await h5.count():
+            await h5.locator(H5_NEXT_DIV_XPATH).first.locator(SCIPRO_COMPONENT).wait_for(
+                state="attached", timeout=20000)
+    except Exception: pass
+
+async def extract_detail(page, url: Optional[str] = None, activity_id: Optional[str] = None) -> dict:
+    """url/activity_id come from the caller when it already knows them (dispatch by URL);
+    otherwise they are derived from where the page ended up (click-through)."""
+    await wait_detail_ready(page)
+    await wait_scientific_program(page)
+    data = {}
+    url = url or page.url
+    data["URL"] = url
+    data["Activity ID"] = activity_id or extract_activity_id_from_url(url)
+    for key, val in await page.evaluate(DETAIL_JS):
+        data[key] = val
+    return data
+
+async def process_row(detail_page, row_url: str, activity_id: Optional[str] = None) -> dict:
+    """Load one detail URL in a worker's long-lived tab and extract it."""
+    # return as soon as the navigation commits; the H4/toggle selector wait below is
+    # what actually gates extraction, so there is no point waiting for DOMContentLoaded
+    with span("goto", id=activity_id):
+        await detail_page.goto(row_url, wait_until="commit", timeout=90000)
+        await ensure_english_detail(detail_page)
+    with span("extract_detail", id=activity_id):
+        return await extract_detail(detail_page, url=row_url, activity_id=activity_id)
+
+def _xlsx_engine() -> str:
+    try:
+        import xlsxwriter  # noqa: F401
+        return "xlsxwriter"
+    except ImportError:
+        return "openpyxl"
+
+XLSX_ENGINE = _xlsx_engine()
+
+def _parquet_available() -> bool:
+    try:
+        import pyarrow  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+MASTER_FORMATS = ("xlsx", "parquet")
+ACTIVITY_FORMATS = ("xlsx", "parquet")  # per-activity files; export_excel.py merges the parquet ones
+CSV_BATCH_ROWS = 25  # master CSV rows per append; the rest go out with the end-of-page flush
+
+def write_activity_xlsx(path: str, row_dict: dict):
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet()
+    ws.append(list(row_dict.keys()))
+    ws.append(list(row_dict.values()))
+    wb.save(path)
+
+def write_activity_file(act_id: str, row_dict: dict, fmt: str = "xlsx") -> str:
+    path = os.path.join(ACTIVITY_DIR, f"detail_{act_id}.{fmt}")
+    if fmt == "parquet":
+        pd.DataFrame([row_dict]).to_parquet(path, index=False, compression="zstd")
+    else:
+        write_activity_xlsx(path, row_dict)
+    return path
+
+class Master:
+    """One shard's master output: every row kept in memory (so the master file can be
+    rebuilt without re-reading it), an append-only CSV log next to it, and the master
+    itself as xlsx (default) or Parquet."""
+
+    def __init__(self, xlsx_path: str, fmt: str = "xlsx", activity_fmt: str = "xlsx"):
+        self.xlsx = xlsx_path
+        self.activity_fmt = activity_fmt
+        self.csv = xlsx_path + ".csv"  # named after the xlsx either way, so resumes find it
+        self.fmt = fmt
+        self.path = xlsx_path if fmt == "xlsx" else os.path.splitext(xlsx_path)[0] + ".parquet"
+        self.buffer: List[dict] = []
+        self.cols: dict = {}             # ordered set of every column seen so far
+        self.seen_ids: Set[str] = set()  # Activity IDs already saved; their rows are skipped
+        self._fh = None
+        self._writer = None
+        self._pending: List[dict] = []   # rows not yet appended to the CSV
+        self.loaded = False              # set by load(); nothing is flushed to disk before that
+
+    def _track_cols(self, row_dict: dict) -> bool:
+        """Add unseen keys to cols; True if the schema grew."""
+        grew = False
+        for k in row_dict:
+            if k not in self.cols:
+                self.cols[k] = None
+                grew = True
+        return grew
+
+    def _open_csv(self, rewrite: bool):
+        """(Re)open the CSV for appending; on rewrite, dump the whole buffer under the current header."""
+        if self._fh: self._fh.close()
+        if rewrite:
+            with open(self.csv, "w", newline="", encoding="utf-8") as fh:
+                w = csv.DictWriter(fh, fieldnames=list(self.cols))
+                w.writeheader()
+                w.writerows(self.buffer)
+            self._pending.clear()  # already part of the buffer just written
+        self._fh = open(self.csv, "a", newline="", encoding="utf-8")
+        self._writer = csv.DictWriter(self._fh, fieldnames=list(self.cols))
+
+    def load(self):
+        """Seed the buffer from a previous run (CSV log preferred, else the old master xlsx)."""
+        self.buffer.clear()
+        self.cols.clear()
+        self.seen_ids.clear()
+        src = None
+        if os.path.exists(self.csv):
+            src = pd.read_csv(self.csv, dtype=str, keep_default_na=False)
+        elif os.path.exists(self.xlsx):
+            src = pd.read_excel(self.xlsx, dtype=str).fillna("")
+        if src is not None:
+            self.cols.update(dict.fromkeys(src.columns))
+            self.buffer.extend(src.to_dict("records"))
+            if "Activity ID" in src.columns:
+                self.seen_ids.update(a for a in src["Activity ID"].astype(str) if a)
+            log(f"[info] Resuming {os.path.basename(self.path)} with {len(self.buffer)} existing rows "
+                f"({len(self.seen_ids)} activity IDs will be skipped).")
+        # rewrite so the CSV always exists and matches cols
+        self._open_csv(rewrite=True)
+        self.loaded = True
+
+    def adopt(self, paths):
+        """Add rows read back from per-activity files to the buffer and the CSV log;
+        returns how many were added."""
+        added = 0
+        for path in paths:
+            try: row = read_activity_file(path)
+            except Exception as e:
+                log(f"[warn] Could not read {path}: {e}")
+                continue
+            self.buffer.append(row)
+            self._track_cols(row)
+            self.seen_ids.add(str(row.get("Activity ID", "")))
+            added += 1
+        self._open_csv(rewrite=True)
+        return added
+
+    def flush_csv(self):
+        """Append the pending rows to the CSV log in one write."""
+        if not self._pending or self._writer is None: return
+        self._writer.writerows(self._pending)
+        self._fh.flush()
+        self._pending.clear()
+
+    def close(self):
+        self.flush_csv()
+        if self._fh: self._fh.close()
+        self._fh = self._writer = None
+
+    def flush(self):
+        """Rebuild the master file from the in-memory buffer in one write."""
+        self.flush_csv()
+        df = pd.DataFrame(self.buffer, columns=list(self.cols))
+        root, ext = os.path.splitext(self.path)
+        tmp = root + ".tmp" + ext
+        if self.fmt == "parquet":
+            df.to_parquet(tmp, index=False)
+        else:
+            df.to_excel(tmp, index=False, engine=XLSX_ENGINE)
+        # swapped in whole, so an upload still reading the previous file is never cut short
+        os.replace(tmp, self.path)
+
+    def upload(self, bucket: str, key: str):
+        return s3_upload_file(self.path, bucket, key)
+
+    def save_row(self, row_dict: dict) -> str:
+        """Write the per-activity file and add the row to the buffer; the CSV log gets rows
+        in batches of CSV_BATCH_ROWS. The master file itself is only rebuilt by flush()."""
+        ensure_out()
+        act_id = row_dict.get("Activity ID", "unknown")
+        per_path = write_activity_file(act_id, row_dict, self.activity_fmt)
+
+        self.buffer.append(row_dict)
+        self.seen_ids.add(str(act_id))
+        if self._track_cols(row_dict) or self._writer is None:
+            self._open_csv(rewrite=True)   # header changed: rare, rewrite once
+        else:
+            self._pending.append(row_dict)
+            if len(self._pending) >= CSV_BATCH_ROWS: self.flush_csv()
+        return per_path
+
+async def recover_list(page, expected_page_no=None, list_timeout_ms: int = 120000):
+    # no load-state wait: the container/rows selector waits are the readiness signal
+    with span("recover_list", page=expected_page_no):
+        cont = await get_list_container(page, timeout_ms=list_timeout_ms)
+        await wait_rows_ready(cont)
+        if expected_page_no:
+            try:
+                cur = await active_page_number(cont)
+                if cur != expected_page_no:
+                    await fast_forward_to_page(cont, expected_page_no)
+            except: pass
+        return cont, await active_page_number(cont)
+
+# ---------- Resume helpers ----------
+def activity_files() -> dict:
+    """Activity ID -> per-activity file, for every file already saved (any shard or run)."""
+    if not os.path.isdir(ACTIVITY_DIR): return {}
+    files = {}
+    for f in os.listdir(ACTIVITY_DIR):
+        m = _ACTIVITY_FILE_RE.match(f)
+        if m: files[m.group(1)] = os.path.join(ACTIVITY_DIR, f)
+    return files
+
+def read_activity_file(path: str) -> dict:
+    df = pd.read_parquet(path) if path.endswith(".parquet") else pd.read_excel(path, dtype=str)
+    return df.astype(str).where(df.notna(), "").iloc[0].to_dict()
+
+def other_master_ids(own_csv: str) -> Set[str]:
+    """Activity IDs in the CSV logs of the other shard layouts/shards under OUT_DIR."""
+    ids = set()
+    for f in glob.glob(os.path.join(OUT_DIR, "external_activities_master*.xlsx.csv")):
+        if os.path.abspath(f) == os.path.abspath(own_csv): continue
+        try:
+            col = pd.read_csv(f, dtype=str, keep_default_na=False, usecols=["Activity ID"])["Activity ID"]
+            ids.update(a for a in col if a)
+        except Exception as e:
+            log(f"[warn] Could not read IDs from {f}: {e}")
+    return ids
+
+def load_checkpoint(path: str) -> dict:
+    if not os.path.exists(path): return {}
+    try:
+        with open(path, encoding="utf-8") as fh:
+            return json.load(fh)
+    except Exception as e:
+        log(f"[warn] Ignoring unreadable {path}: {e}")
+        return {}
+
+def save_checkpoint(path: str, last_page: int):
+    # finished IDs already live in the master CSV log, which --resume reloads
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as fh:
+        json.dump({"last_page": last_page}, fh)
+    os.replace(tmp, path)  # never leave a half-written checkpoint behind
+
+# ---------- Pages file helpers ----------
+def parse_pages_file(path: str) -> List[int]:
+    if not path: return []
+    raw = open(path, "r", encoding="utf-8", errors="ignore").read()
+    # accept any separators (newline, comma, space)
+    tokens = _DIGITS_RE.findall(raw)
+    pages = sorted({int(t) for t in tokens if t.isdigit() and int(t) >= 1})
+    return pages
+
+def shard_pages(pages: List[int], shard_count: int, shard_index: int) -> List[int]:
+    """Round-robin split to avoid overlaps; stable order preserved."""
+    out = []
+    for i, p in enumerate(pages):
+        if i % shard_count == shard_index:
+            out.append(p)
+    return out
+
+# ------------- Main -------------
+async def run_shard(browser, shard_index: int, shard_count: int, *, max_pages: int, start_page: int,
+                    list_timeout_ms: int, s3_bucket: Optional[str], s3_prefix: str, s3_master_every: int,
+                    pages_file: Optional[str], workers: int, block_assets: bool, master_format: str = "xlsx",
+                    log_xhr: bool = False, recycle_every: int = 0, resume: bool = False,
+                    activity_format: str = "xlsx"):
+    """One shard end to end on a shared browser: its own list context, worker contexts and master."""
+
+    # shard-aware paths
+    shard_suffix = "" if shard_count == 1 else f"_shard{shard_index+1}of{shard_count}"
+    master = Master(os.path.join(OUT_DIR, f"external_activities_master{shard_suffix}.xlsx"),
+                    master_format, activity_format)
+    ensure_out()
+    checkpoint_path = os.path.join(OUT_DIR, f"checkpoint{shard_suffix}.json")
+
+    if s3_bucket:
+        s3_prefix = f"{s3_prefix.rstrip('/')}/shard_{shard_index+1}of{shard_count}"
+
+    # If a pages-file was provided, load and split it per shard
+    target_pages: List[int] = []
+    if pages_file:
+        all_pages = parse_pages_file(pages_file)
+        target_pages = shard_pages(all_pages, shard_count, shard_index)
+        log(f"[info] Loaded {len(all_pages)} pages from {pages_file}; "
+            f"this shard will process {len(target_pages)} of them.")
+
+    # Uploads run on a thread pool; failures are logged as they happen and counted at the end.
+    upload_pool = ThreadPoolExecutor(max_workers=UPLOAD_WORKERS, thread_name_prefix="s3") if s3_bucket else None
+    upload_futures = []
+    master_upload = None  # at most one interim master upload in flight
+    csv_upload = None     # ... and one interim CSV snapshot upload
+
+    def submit_upload(what: str, fn, *args):
+        fut = upload_pool.submit(fn, *args)
+        fut.add_done_callback(lambda f: f.exception() and log(f"[warn] {what}: {f.exception()}"))
+        upload_futures.append(fut)
+        return fut
+
+    def drain_uploads():
+        if not upload_pool: return
+        upload_pool.shutdown(wait=True)
+        failed = sum(1 for f in upload_futures if f.exception())
+        log(f"[s3] {len(upload_futures) - failed}/{len(upload_futures)} uploads succeeded.")
+
+    def s3_key(path: str) -> str:
+        rel = os.path.relpath(path, start=OUT_DIR).replace("\\", "/")
+        return f"{s3_prefix.rstrip('/')}/{rel}"
+
+    pending_rows = 0    # rows saved since the last master xlsx rebuild
+    unsynced_rows = 0   # rows saved since the last CSV snapshot upload
+    def maybe_upload_activity(filepath: str):
+        if not s3_bucket: return
+        key = s3_key(filepath)
+        log(f"[s3] upload {os.path.relpath(filepath, start=OUT_DIR)} -> s3://{s3_bucket}/{key}")
+        submit_upload(f"upload {key}", s3_upload_file, filepath, s3_bucket, key)
+
+    def maybe_upload_master(force=False, final=False):
+        """The CSV log is the per-row record; the master xlsx is only rebuilt when forced
+        (end of page / end of shard). With S3 on and N > 0, every N rows send a CSV snapshot.
+        While the previous master upload is still in flight an end-of-page rebuild is
+        skipped too; the final one (end of shard) always goes up."""
+        nonlocal pending_rows, unsynced_rows, master_upload, csv_upload
+        if not pending_rows: return
+        if force:
+            if s3_bucket and not final and master_upload and not master_upload.done():
+                return  # pending_rows stays set: rebuilt and sent with the next page's (or the final) upload
+            master.flush()
+            pending_rows = unsynced_rows = 0
+            if not s3_bucket: return
+            key = s3_key(master.path)
+            log(f"[s3] upload master -> s3://{s3_bucket}/{key}")
+            master_upload = submit_upload("upload master", master.upload, s3_bucket, key)
+        elif s3_bucket and s3_master_every and unsynced_rows >= s3_master_every:
+            if csv_upload and not csv_upload.done():
+                return  # previous snapshot still uploading; these rows ride along with the next one
+            unsynced_rows = 0
+            # snapshot so the uploader never reads a half-appended row
+            master.flush_csv()
+            snap = master.csv + ".upload"
+            shutil.copyfile(master.csv, snap)
+            key = s3_key(master.csv)
+            log(f"[s3] upload master csv -> s3://{s3_bucket}/{key}")
+            csv_upload = submit_upload("upload master csv", s3_upload_file, snap, s3_bucket, key)
+
+    # Rows are persisted by one writer thread, in order, while the browser moves on.
+    # Everything that touches master (save_row, flush) runs on it, so no extra locking.
+    writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="writer")
+
+    def persist_record(record: dict):
+        nonlocal pending_rows, unsynced_rows
+        try:
+            with span("save_row", id=record.get("Activity ID")):
+                per_file = master.save_row(record)
+        except Exception as e:
+            log(f"[warn] could not save Activity ID={record.get('Activity ID', '?')}: {e}")
+            return
+        pending_rows += 1
+        unsynced_rows += 1
+        maybe_upload_activity(per_file)
+        maybe_upload_master(force=False)
+
+    def checkpoint(page_no: int):
+        try: save_checkpoint(checkpoint_path, page_no)
+        except Exception as e: log(f"[warn] Could not write checkpoint: {e}")
+
+    async def sync_master(page_no: Optional[int] = None, final: bool = False):
+        """Wait for queued rows to be written, then rebuild/upload the master file and,
+        after a finished page, record it in the checkpoint."""
+        await asyncio.wrap_future(writer.submit(maybe_upload_master, True, final))
+        if page_no: await asyncio.wrap_future(writer.submit(checkpoint, page_no))
+
+    contexts = []
+    async def finish_shard():
+        try:
+            if master.loaded: await sync_master(final=True)
+        except BaseException as e:
+            log(f"[warn] Final master flush failed: {e!r}")
+        writer.shutdown(wait=True)
+        await asyncio.to_thread(drain_uploads)  # other in-process shards keep running meanwhile
+        if master.loaded: master.close()
+        for c in contexts:
+            try: await c.close()
+            except: pass
+
+    def handle_record(record: dict):
+        log(f"[ok] extracted Activity ID={record.get('Activity ID', '?')}")
+        master.seen_ids.add(str(record.get("Activity ID", "unknown")))
+        writer.submit(persist_record, record)
+
+    # whatever ends the shard (done, an exception, Ctrl-C), queued rows, the master
+    # rebuild and the pending uploads are still written out
+    try:
+        master.load()
+        load_detail_url()
+        # per-activity files whose row is not in this master: if another shard's master has
+        # it, just skip the ID; otherwise it was lost before the batched CSV append (crash),
+        # so read it back in. Orphans are split by ID across shards so only one adopts each;
+        # every shard skips all of them, and adopted rows count as pending for the master rebuild.
+        files = activity_files()
+        extra = set(files) - master.seen_ids
+        if extra:
+            elsewhere = extra & other_master_ids(master.csv)
+            orphans = [a for a in sorted(extra - elsewhere) if int(a) % shard_count == shard_index]
+            master.seen_ids.update(extra)
+            if orphans:
+                pending_rows = master.adopt(files[a] for a in orphans)
+                log(f"[info] Recovered {pending_rows} rows from {ACTIVITY_DIR} missing from the master.")
+            if elsewhere:
+                log(f"[info] {len(elsewhere)} activity IDs are in other shards' masters; they will be skipped.")
+        resume_after = load_checkpoint(checkpoint_path).get("last_page") if resume else None
+        if resume_after: log(f"[info] Resuming after page {resume_after} (from {checkpoint_path}).")
+
+        list_ctx = await new_list_context(browser)
+        contexts.append(list_ctx)
+        if block_assets: await install_asset_blocking(list_ctx)
+        page = await list_ctx.new_page()
+        xhr_seen = watch_xhr(page) if log_xhr else None
+        log(f"[step] Shard {shard_index+1}/{shard_count} starting. Go to root list")
+        # Robust navigation: keep trying until connected
+        attempt = 0
+        while True:
+            try:
+                await page.goto(ROOT_URL, wait_until="domcontentloaded", timeout=90000)
+                await page.wait_for_selector(f"{LIST_COMPONENT}, {ENGLISH_SWITCH}", state="visible", timeout=30000)
+                break
+            except Exception as e:
+                delay = retry_delay(attempt, e)
+                log(f"[warn] Initial goto failed, retrying in {delay:.1f}s: {e}")
+                await asyncio.sleep(delay)
+                attempt += 1
+
+        # with a restored state the app boots in English and this returns at once;
+        # the state file is only (re)written when the language actually had to be set
+        if await robust_switch_to_english(page) or not os.path.exists(STATE_PATH):
+            try: await list_ctx.storage_state(path=STATE_PATH)
+            except Exception as e: log(f"[warn] Could not save browser state: {e}")
+
+        cont = await get_list_container(page, timeout_ms=list_timeout_ms)
+        await wait_rows_ready(cont)
+
+        # Worker contexts inherit the list context's cookies/localStorage (language choice).
+        # Each worker keeps one detail tab for the whole run; the queue doubles as the
+        # concurrency bound: a row task holds a tab while it runs.
+        state = await list_ctx.storage_state()
+        pool: asyncio.Queue = asyncio.Queue()
+        navs = {}  # detail tab -> navigations since its context was created
+
+        async def new_worker():
+            wctx = await browser.new_context(storage_state=state, **CONTEXT_OPTS)
+            contexts.append(wctx)
+            if block_assets: await install_asset_blocking(wctx)
+            wpage = await wctx.new_page()
+            if log_xhr: watch_xhr(wpage, xhr_seen)
+            navs[wpage] = 0
+            return wpage
+
+        async def recycle_worker(detail_page):
+            """Swap a long-used worker for a fresh context; detached DOM and heap from past
+            navigations go away with the old one. Keeps the old tab if the swap fails."""
+            try: fresh = await new_worker()
+            except Exception as e:
+                log(f"[warn] Could not recycle worker context: {e}")
+                navs[detail_page] = 0
+                return detail_page
+            navs.pop(detail_page, None)
+            old = detail_page.context
+            if old in contexts: contexts.remove(old)
+            try: await old.close()
+            except: pass
+            return fresh
+
+        for _ in range(workers):
+            pool.put_nowait(await new_worker())
+        log(f"[info] {workers} detail worker(s) ready.")
+
+        async def run_row(n: int, r: int, url: str, aid: str):
+            detail_page = await pool.get()
+            try:
+                with span("row", page=n, row=r+1, id=aid):
+                    record = await process_row(detail_page, url, aid)
+            except Exception as e:
+                log(f"[warn] extraction failed on page {n}, row {r+1}: {e}")
+                return
+            finally:
+                navs[detail_page] = navs.get(detail_page, 0) + 1
+                if recycle_every and navs[detail_page] >= recycle_every:
+                    detail_page = await recycle_worker(detail_page)
+                pool.put_nowait(detail_page)
+            handle_record(record)
+
+        async def click_through_row(n: int, r: int, cells: List[str]):
+            """Legacy path for rows whose eye action has no href: navigate from the list page."""
+            nonlocal cont
+            try:
+                row = cont.locator(ROW_SELECTOR).nth(r)
+                eye = await find_row_eye(row)
+                if not eye:
+                    log(f"[skip] no 'view' action for row {r+1} on page {n}")
+                    return
+
+                async with page.expect_navigation(wait_until="commit"):
+                    await eye.click()
+                try:
+                    record = await extract_detail(page)
+                    learn_detail_url(record, cells)
+                    handle_record(record)
+                except Exception as e:
+                    log(f"[warn] extraction failed on page {n}, row {r+1}: {e}")
+
+                # straight back to the list URL; recover_list re-waits and fast-forwards to page n
+                await page.goto(ROOT_URL, wait_until="domcontentloaded", timeout=90000)
+                cont, _ = await recover_list(page, expected_page_no=n, list_timeout_ms=list_timeout_ms)
+            except Exception as e:
+                log(f"[warn] Row {r+1} failure on page {n}: {e}")
+                try:
+                    cont, _ = await recover_list(page, expected_page_no=n, list_timeout_ms=list_timeout_ms)
+                except:
+                    pass
+
+        async def process_page(n: int):
+            log(f"[page][shard {shard_index+1}/{shard_count}] Processing page {n}")
+            rows = await harvest_rows(cont)
+            log(f"[info] rows found: {len(rows)}")
+
+            # rows with a known URL go to the worker pool in parallel; the list page stays put
+            tasks, pending, skipped = [], [], 0
+            def dispatch(r: int) -> bool:
+                nonlocal skipped
+                url = row_detail_url(rows[r])
+                if not url: return False
+                aid = extract_activity_id_from_url(url)
+                if aid in master.seen_ids: skipped += 1
+                else: tasks.append(asyncio.create_task(run_row(n, r, url, aid)))
+                return True
+
+            pending = [r for r in range(len(rows)) if not dispatch(r)]
+            # the rest click through on the list page until the URL pattern is learned
+            while pending:
+                r = pending.pop(0)
+                await click_through_row(n, r, rows[r].get("cells") or [])
+                if DETAIL_URL_BASE is not None:
+                    pending = [r2 for r2 in pending if not dispatch(r2)]
+            if skipped: log(f"[skip] {skipped} row(s) on page {n} already in master")
+            if tasks: await asyncio.gather(*tasks)
+
+        # --- MODE A: process a specific set of pages (from --pages-file) ---
+        if target_pages:
+            # Ensure ascending unique pages
+            target_pages = sorted(set(target_pages))
+            if resume_after:
+                target_pages = [tp for tp in target_pages if tp > resume_after]
+            for tp in target_pages:
+                try:
+                    cur = await active_page_number(cont) or 1
+                    if cur != tp:
+                        log(f"[step] Jump to target page {tp} (current {cur}) …")
+                        await fast_forward_to_page(cont, tp)
+                        cont, _ = await recover_list(page, expected_page_no=tp, list_timeout_ms=list_timeout_ms)
+
+                    await process_page(tp)
+                    await sync_master(tp)
+
+                    # honor --max-pages for this mode too (pages count per shard)
+                    if max_pages:
+                        processed_so_far = target_pages.index(tp) + 1
+                        if processed_so_far >= max_pages:
+                            log("[done] Reached --max-pages cap for this shard (pages-file mode).")
+                            break
+
+                except Exception as e:
+                    log(f"[warn] Could not complete target page {tp}: {e}")
+                    # try to recover to list (page number may be unknown now)
+                    try:
+                        cont, _ = await recover_list(page, list_timeout_ms=list_timeout_ms)
+                    except:
+                        pass
+
+            return
+
+        # --- MODE B: legacy stride mode (no pages-file) ---
+        eff_start = max(1, start_page) + (shard_index if shard_count > 1 else 0)
+        if resume_after and resume_after >= eff_start:
+            eff_start = resume_after + (shard_count if shard_count > 1 else 1)  # next page in this shard's stride
+        if eff_start > 1:
+            log(f"[step] Fast-forwarding to shard start page {eff_start} …")
+            try: await fast_forward_to_page(cont, eff_start)
+            except Exception as e: log(f"[warn] Could not fast-forward neatly: {e}")
+
+        processed_pages = 0
+        current_page = await active_page_number(cont) or eff_start
+
+        while True:
+            await process_page(current_page)
+
+            processed_pages += 1
+            await sync_master(current_page)
+
+            if max_pages and processed_pages >= max_pages:
+                log("[done] Reached --max-pages cap for this shard.")
+                break
+
+            stride = shard_count if shard_count > 1 else 1
+            if not await click_next_k(cont, stride):
+                log("[done] Reached last page (or next disabled) for this shard.")
+                break
+            current_page = (await active_page_number(cont) or (current_page + stride))
+    finally:
+        await finish_shard()
+
+async def main(max_pages:int, headless:bool, start_page:int, list_timeout_ms:int,
+               s3_bucket: Optional[str], s3_prefix: str, s3_master_every: int,
+               shard_count:int, shard_index:int, pages_file: Optional[str],
+               workers: int = DEFAULT_WORKERS, block_assets: bool = True, in_process_shards: int = 1,
+               master_format: str = "xlsx", log_xhr: bool = False,
+               recycle_every: int = DEFAULT_RECYCLE_EVERY, resume: bool = False,
+               activity_format: str = "xlsx", trace_spans: bool = False):
+
+    # ---- validate shards ----
+    if shard_count < 1:
+        raise ValueError("--shard-count must be >= 1")
+    if not (0 <= shard_index < shard_count):
+        raise ValueError("--shard-index must be in [0, shard-count-1]")
+    if workers < 1:
+        raise ValueError("--workers must be >= 1")
+    if recycle_every < 0:
+        raise ValueError("--recycle-every must be >= 0")
+    if in_process_shards < 1:
+        raise ValueError("--in-process-shards must be >= 1")
+    if in_process_shards > 1 and shard_count > 1:
+        raise ValueError("use either --in-process-shards or --shard-count/--shard-index, not both")
+    if master_format not in MASTER_FORMATS:
+        raise ValueError(f"--master-format must be one of {', '.join(MASTER_FORMATS)}")
+    if master_format == "parquet" and not _parquet_available():
+        raise ValueError("--master-format parquet needs pyarrow (pip install pyarrow)")
+    if activity_format not in ACTIVITY_FORMATS:
+        raise ValueError(f"--activity-format must be one of {', '.join(ACTIVITY_FORMATS)}")
+    if activity_format == "parquet" and not _parquet_available():
+        raise ValueError("--activity-format parquet needs pyarrow (pip install pyarrow)")
+
+    global TRACE_SPANS
+    TRACE_SPANS = trace_spans
+
+    opts = dict(max_pages=max_pages, start_page=start_page, list_timeout_ms=list_timeout_ms,
+                s3_bucket=s3_bucket, s3_prefix=s3_prefix, s3_master_every=s3_master_every,
+                pages_file=pages_file, workers=workers, block_assets=block_assets,
+                master_format=master_format, log_xhr=log_xhr, recycle_every=recycle_every,
+                resume=resume, activity_format=activity_format)
+
+    async with async_playwright() as p:
+        browser = await p.chromium.launch(headless=headless,
+                                          args=LAUNCH_ARGS + (LAUNCH_ARGS_NO_ASSETS if block_assets else []))
+        if in_process_shards > 1:
+            # K shards of a K-way split, each with its own contexts, sharing one Chromium
+            results = await asyncio.gather(*[run_shard(browser, i, in_process_shards, **opts)
+                                             for i in range(in_process_shards)], return_exceptions=True)
+            for i, res in enumerate(results):
+                if isinstance(res, Exception):
+                    log(f"[warn] Shard {i+1}/{in_process_shards} aborted: {res}")
+        else:
+            await run_shard(browser, shard_index, shard_count, **opts)
+        await browser.close()
+    if TRACE_SPANS: log_span_totals()
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--max-pages", type=int, default=0,
+                    help="How many pages THIS SHARD will process (0 = until end; applies to pages-file mode too).")
+    ap.add_argument("--start-page", type=int, default=1,
+                    help="Global 1-based start page. With sharding, effective start = start-page + shard-index.")
+    ap.add_argument("--headless", action="store_true", help="Run headless.")
+    ap.add_argument("--list-timeout-ms", type=int, default=120000,
+                    help="Timeout in ms to wait for <app-list-external-activities> to appear/settle.")
+    ap.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                    help="Parallel detail-page worker contexts (sharing one browser).")
+    ap.add_argument("--recycle-every", type=int, default=DEFAULT_RECYCLE_EVERY,
+                    help="Replace a worker's browser context after N detail pages to shed leaked "
+                         "DOM/heap on long runs (0 = never).")
+    ap.add_argument("--no-block-assets", action="store_true",
+                    help="Load images/fonts/media/stylesheets and trackers (blocked by default).")
+    ap.add_argument("--master-format", choices=MASTER_FORMATS, default="xlsx",
+                    help="Format of the rebuilt master file (the per-row CSV log is kept either way). "
+                         "parquet is much cheaper to rebuild on large runs; needs pyarrow.")
+    ap.add_argument("--activity-format", choices=ACTIVITY_FORMATS, default="xlsx",
+                    help="Format of the per-activity files in out/activities/. parquet (zstd) is much "
+                         "cheaper per row; merge them to xlsx with export_excel.py. Needs pyarrow.")
+    ap.add_argument("--trace-spans", action="store_true",
+                    help="Time goto/extract/save/click_next/recover_list; one JSON line per span, "
+                         "totals (sorted by time) at the end.")
+    ap.add_argument("--log-xhr", action="store_true",
+                    help="Log each distinct XHR/fetch call (list and detail pages) and save one sample "
+                         "of each JSON exchange under out/xhr/, to identify the underlying API. "
+                         "Token-like headers, query params and fields are redacted, but payloads are "
+                         "otherwise saved as is; treat out/xhr/ as private.")
+
+    # Optional S3
+    ap.add_argument("--s3-bucket", type=str, default="", help="If set, upload outputs to this S3 bucket.")
+    ap.add_argument("--s3-prefix", type=str, default="runs/current",
+                    help="Key prefix (e.g., runs/2025-11-05).")
+    ap.add_argument("--s3-master-upload-every", type=int, default=0,
+                    help="With S3 on, also upload a snapshot of the master CSV every N rows (0 = off). "
+                         "The master file is rebuilt (and uploaded) at end-of-page/end-of-run.")
+
+    # Sharding
+    ap.add_argument("--shard-count", type=int, default=1, help="Total parallel shards.")
+    ap.add_argument("--shard-index", type=int, default=0, help="Zero-based shard index (0..count-1).")
+    ap.add_argument("--in-process-shards", type=int, default=1,
+                    help="Run K shards (a K-way split) as async tasks sharing one browser, "
+                         "instead of K separate processes. --workers applies per shard.")
+
+    ap.add_argument("--resume", action="store_true",
+                    help="Continue after the last page recorded in this shard's out/checkpoint*.json.")
+
+    # NEW: pages file
+    ap.add_argument("--pages-file", type=str, default="",
+                    help="Path to a text file listing EXACT pages to process (one per line, commas/spaces OK).")
+
+    args = ap.parse_args()
+    asyncio.run(main(
+        max_pages=args.max_pages,
+        headless=args.headless,
+        start_page=args.start_page,
+        list_timeout_ms=args.list_timeout_ms,
+        s3_bucket=(args.s3_bucket or None),
+        s3_prefix=args.s3_prefix,
+        s3_master_every=max(0, args.s3_master_upload_every),
+        shard_count=args.shard_count,
+        shard_index=args.shard_index,
+        pages_file=(args.pages_file or None),
+        workers=args.workers,
+        block_assets=not args.no_block_assets,
+        in_process_shards=args.in_process_shards,
+        master_format=args.master_format,
+        log_xhr=args.log_xhr,
+        recycle_every=args.recycle_every,
+        resume=args.resume,
+        activity_format=args.activity_format,
+        trace_spans=args.trace_spans,
+    ))